@@ -1,31 +1,53 @@
 #!/usr/bin/env python3
 
+import asyncio
+import atexit
+import codecs
+import contextlib
+import hashlib
 import logging
 import os
+import queue
+import re
+import shutil
 import sys
 import json
+import threading
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 from pathlib import Path
+from itertools import chain, islice
 from textwrap import dedent
 from typing import List, Dict, Any, Optional
-from openai import OpenAI
-from pydantic import BaseModel
+import diskcache
+import ijson
+import msgspec
 from dotenv import load_dotenv
-from rich.console import Console, Group
-from rich.table import Table
+from rich.console import Console
 from rich.panel import Panel
-from rich.rule import Rule
-from prompt_toolkit import PromptSession
-from prompt_toolkit.styles import Style as PromptStyle
-from collections import deque
 
-# Initialize Rich console and prompt session
+# openai, prompt_toolkit and the less common rich renderables are imported on
+# first use: openai alone costs more at import than everything else combined,
+# and deferring them lets the welcome banner paint before they load.
+
+# Initialize Rich console
 console = Console()
-prompt_session = PromptSession(
-    style=PromptStyle.from_dict({
-        'prompt': '#00aa00 bold',  # Green prompt
-    })
-)
+_prompt_session = None
+
+def get_prompt_session():
+    global _prompt_session
+    if _prompt_session is None:
+        from prompt_toolkit import PromptSession
+        from prompt_toolkit.styles import Style as PromptStyle
+        _prompt_session = PromptSession(
+            style=PromptStyle.from_dict({
+                'prompt': '#00aa00 bold',  # Green prompt
+            })
+        )
+    return _prompt_session
+
 # Initialize logging
 logging.basicConfig(
     level=logging.INFO,
@@ -41,51 +63,164 @@ logger = logging.getLogger(__name__)
 # 1. Configure OpenAI client and load environment variables
 # --------------------------------------------------------------------------------
 load_dotenv()  # Load environment variables from .env file
-client = OpenAI(
-    api_key=os.getenv("DEEPSEEK_API_KEY"),
-    base_url="https://api.deepseek.com"
-)  # Configure for DeepSeek API
+_client = None
+
+def get_client():
+    """Return the shared DeepSeek API client, creating it on first use."""
+    global _client
+    if _client is None:
+        import httpx
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient, Timeout
+        # One keep-alive pool for the whole session so follow-up turns skip the
+        # TCP/TLS handshake; HTTP/2 multiplexes concurrent streams on one socket.
+        # The limits come from httpx, which openai 1.x (pinned <2) is built on.
+        http_client = DefaultAsyncHttpxClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=20, keepalive_expiry=60),
+            timeout=Timeout(600.0, connect=5.0)
+        )
+        _client = AsyncOpenAI(
+            api_key=os.getenv("DEEPSEEK_API_KEY"),
+            base_url="https://api.deepseek.com",
+            http_client=http_client
+        )  # Configure for DeepSeek API
+    return _client
+
+def log_connection_pool():
+    """Debug aid: report how many pooled connections the API client holds."""
+    if _client is None or not logger.isEnabledFor(logging.DEBUG):
+        return
+    pool = getattr(getattr(_client._client, "_transport", None), "_pool", None)
+    connections = getattr(pool, "connections", None)
+    if connections is not None:
+        logger.debug(f"HTTP connection pool: {len(connections)} connection(s): {connections}")
+
+# Persistent exact-match cache of final responses, keyed by the hashed request messages
+RESPONSE_CACHE = diskcache.Cache(".ds_cache")
 
 class RateLimiter:
     def __init__(self, max_calls: int, period: float):
         self.max_calls = max_calls
         self.period = period
-        self.timestamps = deque()
-
-    def __call__(self):
-        now = time.time()
-        while self.timestamps and now - self.timestamps[0] > self.period:
-            self.timestamps.popleft()
-
-        if len(self.timestamps) >= self.max_calls:
-            time_to_wait = self.period - (now - self.timestamps[0])
-            time.sleep(time_to_wait)
-            now = time.time()
-
-        self.timestamps.append(now)
+        # Ring buffer of the last max_calls call times; the slot at self.index is the oldest
+        self.timestamps = [float("-inf")] * max_calls
+        self.index = 0
+
+    async def __call__(self):
+        now = time.monotonic()
+        time_to_wait = self.timestamps[self.index] + self.period - now
+        if time_to_wait > 0:
+            await asyncio.sleep(time_to_wait)
+            now += time_to_wait
+
+        self.timestamps[self.index] = now
+        self.index = (self.index + 1) % self.max_calls
         return now
 
-    def __enter__(self):
-        self()
+    async def __aenter__(self):
+        await self()
         return self
 
-    def __exit__(self, *args):
+    async def __aexit__(self, *args):
         pass
 
+class SemanticCache:
+    """
+    Near-duplicate response cache. User prompts are embedded with a local
+    sentence-transformers model and searched in a persisted FAISS inner-product
+    index; a hit needs cosine similarity >= threshold and the same files and prior
+    conversation, so follow-ups like "try again" never replay an earlier turn.
+    Disabled when faiss/sentence-transformers are not installed.
+    """
+    def __init__(self, directory: str, threshold: float = 0.9,
+                 model_name: str = "sentence-transformers/all-MiniLM-L6-v2"):
+        self.index_path = os.path.join(directory, "semantic-ids.faiss")
+        self.threshold = threshold
+        self.model_name = model_name
+        self.enabled = True
+        self._faiss = None
+        self._np = None
+        self._model = None
+        self._index = None
+
+    def _load(self) -> bool:
+        if self._index is not None:
+            return True
+        if not self.enabled:
+            return False
+        try:
+            import faiss
+            import numpy as np
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            logger.info("Semantic cache disabled: install faiss-cpu and sentence-transformers to enable it")
+            self.enabled = False
+            return False
+
+        try:
+            self._model = SentenceTransformer(self.model_name)
+            if os.path.exists(self.index_path):
+                self._index = faiss.read_index(self.index_path)
+            else:
+                self._index = faiss.IndexIDMap(
+                    faiss.IndexFlatIP(self._model.get_sentence_embedding_dimension())
+                )
+        except Exception:
+            logger.exception("Semantic cache disabled: failed to load embedding model or index")
+            self.enabled = False
+            return False
+        self._faiss = faiss
+        self._np = np
+        return True
+
+    def _embed(self, user_message: str):
+        # Normalized embeddings make inner product equal to cosine similarity
+        return self._model.encode([user_message], normalize_embeddings=True).astype("float32")
+
+    @staticmethod
+    def context_key(file_hashes: List[str], history: List[Dict[str, Any]]) -> str:
+        payload = json.dumps([sorted(file_hashes), history], sort_keys=True, ensure_ascii=False)
+        return hashlib.blake2b(payload.encode("utf-8")).hexdigest()
+
+    def lookup(self, user_message: str, context_key: str) -> Optional[str]:
+        if not self._load() or self._index.ntotal == 0:
+            return None
+        scores, ids = self._index.search(self._embed(user_message), min(5, self._index.ntotal))
+        for score, entry_id in zip(scores[0], ids[0]):
+            if entry_id < 0 or score < self.threshold:
+                break
+            entry = RESPONSE_CACHE.get(f"semantic-entry:{entry_id}")
+            if entry and entry[0] == context_key:
+                logger.info(f"Semantic cache hit (similarity {score:.3f})")
+                return entry[1]
+        return None
+
+    def add(self, user_message: str, context_key: str, response: str):
+        if not self._load():
+            return
+        # diskcache increments atomically, so concurrent sessions never share an id
+        entry_id = RESPONSE_CACHE.incr("semantic-next-id")
+        RESPONSE_CACHE.set(f"semantic-entry:{entry_id}", (context_key, response))
+        self._index.add_with_ids(self._embed(user_message), self._np.array([entry_id], dtype="int64"))
+        self._faiss.write_index(self._index, self.index_path)
+
+SEMANTIC_CACHE = SemanticCache(".ds_cache")
+
 # --------------------------------------------------------------------------------
-# 2. Define our schema using Pydantic for type safety
+# 2. Define our schema using msgspec for type safety
 # --------------------------------------------------------------------------------
-class FileToCreate(BaseModel):
+# msgspec decodes and validates the response JSON in one compiled pass
+class FileToCreate(msgspec.Struct):
     path: str
     content: str
 
-class FileToEdit(BaseModel):
+class FileToEdit(msgspec.Struct):
     path: str
     original_snippet: str
     new_snippet: str
 
-class AssistantResponse(BaseModel):
-    assistant_reply: str
+class AssistantResponse(msgspec.Struct):
+    assistant_reply: str = ""
     files_to_create: Optional[List[FileToCreate]] = None
     files_to_edit: Optional[List[FileToEdit]] = None
 
@@ -163,8 +298,124 @@ def read_local_file(file_path: str) -> str:
     with open(file_path, "r", encoding="utf-8") as f:
         return f.read()
 
-def create_file(path: str, content: str, require_confirmation: bool = True):
-    """Create (or overwrite) a file at 'path' with the given 'content'."""
+def content_sha256(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+class FileStager:
+    """
+    Parses the streamed assistant JSON incrementally with ijson and, as each
+    files_to_create item completes, writes it on a worker thread to a temp file
+    under the gitignored .ds_cache/staged directory, out of sight of git, editors
+    and file watchers. Disk writes overlap with generation, and create_file only
+    has to os.replace the staged file once the user confirms. Staging is
+    best-effort: anything it cannot handle (leading prose with braces, trailing
+    fences) is simply written by create_file as usual after the stream ends.
+    """
+    def __init__(self, directory: str, stale_after: float = 3600):
+        self.directory = os.path.abspath(directory)
+        self.staged: Dict[tuple, str] = {}  # (normalized_path, sha256) -> staged temp path
+        self._sweep(stale_after)
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._drain, name="file-stager", daemon=True)
+        self._worker.start()
+        self.begin()
+
+    def begin(self):
+        """Start parsing a new response."""
+        self.finish()
+        self.discard()
+        self._items = ijson.sendable_list()
+        self._parser = ijson.items_coro(self._items, "files_to_create.item")
+        self._json_started = False
+        self._failed = False
+
+    def feed(self, text: str):
+        if self._failed:
+            return
+        if not self._json_started:
+            # Skip anything before the JSON object, e.g. a ```json fence
+            start = text.find("{")
+            if start < 0:
+                return
+            text = text[start:]
+            self._json_started = True
+        try:
+            self._parser.send(text.encode("utf-8"))
+        except ijson.JSONError:
+            # Usually the closing fence after the object; the full parse still runs later
+            self._failed = True
+        finally:
+            for item in self._items:
+                self._queue.put(item)
+            del self._items[:]
+
+    def finish(self):
+        """Wait until every item seen so far has been staged."""
+        self._queue.join()
+
+    def take(self, normalized_path: str, sha: str) -> Optional[str]:
+        """Return the staged temp file for exactly this path and content hash, if any."""
+        return self.staged.pop((normalized_path, sha), None)
+
+    def discard(self):
+        """Remove staged files that were never committed (e.g. declined by the user)."""
+        for staged_path in self.staged.values():
+            try:
+                os.unlink(staged_path)
+            except OSError:
+                pass
+        self.staged.clear()
+
+    def _sweep(self, stale_after: float):
+        """
+        Remove files orphaned by sessions that never reached discard() (closed
+        terminal, SIGKILL). Recent files may belong to another live session in
+        the same directory; create_file rewrites the content if its file vanishes.
+        """
+        cutoff = time.time() - stale_after
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file() and entry.stat().st_mtime < cutoff:
+                            os.unlink(entry.path)
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+
+    def _drain(self):
+        while True:
+            item = self._queue.get()
+            try:
+                self._stage(item)
+            except Exception:
+                logger.exception("Failed to stage streamed file")
+            finally:
+                self._queue.task_done()
+
+    def _stage(self, item: Dict[str, Any]):
+        path, content = item.get("path"), item.get("content")
+        if not isinstance(path, str) or not isinstance(content, str) or len(content) > 5_000_000:
+            return
+        if any(part.startswith('~') for part in Path(path).parts):
+            return
+        normalized_path = normalize_path(path)
+        os.makedirs(self.directory, exist_ok=True)
+        staged_path = os.path.join(self.directory, f"{uuid.uuid4().hex}.ds-staged")
+        with open(staged_path, "x", encoding="utf-8") as f:
+            f.write(content)
+        self.staged[(normalized_path, content_sha256(content))] = staged_path
+
+FILE_STAGER = FileStager(os.path.join(RESPONSE_CACHE.directory, "staged"))
+atexit.register(FILE_STAGER.discard)
+
+def create_file(path: str, content: str):
+    """
+    Create (or overwrite) a file at 'path' with the given 'content'. Callers confirm with the
+    user beforehand. If FILE_STAGER already wrote exactly that content while the response
+    streamed, it is moved into place instead.
+    """
     logger = logging.getLogger(__name__)
     try:
         file_path = Path(path)
@@ -178,36 +429,29 @@ def create_file(path: str, content: str, require_confirmation: bool = True):
         if len(content) > 5_000_000:  # 5MB limit
             raise ValueError("File content exceeds 5MB size limit")
 
-        # Confirm file creation
-        if require_confirmation:
-            user_confirm = prompt_session.prompt(
-                f"Do you want to create/overwrite file at '{normalized_path}'? (y/n): "
-            ).strip().lower()
-        else:
-            user_confirm = 'y'  # Default to 'y' when confirmation is not required
-
-        if user_confirm != 'y' and user_confirm:  # Handle both skipped prompt and 'n' answer
-            logger.info(f"Skipped file creation at '{normalized_path}'")
-            console.print(f"[yellow]ℹ[/yellow] Skipped file creation at '[cyan]{normalized_path}[/cyan]'", style="yellow")
-            return
+        # Hash once; it keys both the staged file lookup and the conversation context
+        sha = content_sha256(content)
+        staged_path = FILE_STAGER.take(normalized_path, sha)
 
         file_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(content)
+        if staged_path:
+            try:
+                if os.path.exists(normalized_path):
+                    shutil.copymode(normalized_path, staged_path)
+                os.replace(staged_path, normalized_path)
+            except OSError:
+                # Swept by another session, or the target is on another filesystem
+                with contextlib.suppress(OSError):
+                    os.unlink(staged_path)
+                staged_path = None
+        if not staged_path:
+            with open(file_path, "w", encoding="utf-8") as f:
+                f.write(content)
         logger.info(f"Created/updated file at '{file_path}'")
         console.print(f"[green]✓[/green] Created/updated file at '[cyan]{file_path}[/cyan]'")
 
-        # Record the action as a system message
-        conversation_history.append({
-            "role": "system",
-            "content": f"File operation: Created/updated file at '{file_path}'"
-        })
-
-        normalized_path = normalize_path(str(file_path))
-        conversation_history.append({
-            "role": "system",
-            "content": f"Content of file '{normalized_path}':\n\n{content}"
-        })
+        _applied_ops.append({"path": normalized_path, "sha256": sha, "size": len(content), "time": time.time()})
+        add_file_to_context(normalized_path, content, sha)
     except Exception as e:
         logger.exception(f"Failed to create file at '{path}'")
         console.print(f"[red]✗[/red] Failed to create file at '[cyan]{path}[/cyan]': {str(e)}", style="red")
@@ -216,6 +460,8 @@ def show_diff_table(files_to_edit: List[FileToEdit]) -> None:
     if not files_to_edit:
         return
 
+    from rich.table import Table
+
     table = Table(title="Proposed Edits", show_header=True, header_style="bold magenta", show_lines=True)
     table.add_column("File Path", style="cyan")
     table.add_column("Original", style="red")
@@ -228,37 +474,69 @@ def show_diff_table(files_to_edit: List[FileToEdit]) -> None:
 
 def apply_diff_edit(path: str, original_snippet: str, new_snippet: str):
     """Reads the file at 'path', replaces the first occurrence of 'original_snippet' with 'new_snippet', then overwrites."""
+    ambiguous = False
     try:
         content = read_local_file(path)
 
-        # Verify we're replacing the exact intended occurrence
-        occurrences = content.count(original_snippet)
-        if occurrences == 0:
+        # Verify we're replacing the exact intended occurrence; the second find
+        # stops at the next match instead of counting them all
+        start = content.find(original_snippet)
+        if start < 0:
             raise ValueError("Original snippet not found")
-        if occurrences > 1:
-            console.print(f"[yellow]Multiple matches ({occurrences}) found - requiring line numbers for safety", style="yellow")
-            console.print("Use format:\n--- original.py (lines X-Y)\n+++ modified.py\n")
-            raise ValueError(f"Ambiguous edit: {occurrences} matches")
-
-        updated_content = content.replace(original_snippet, new_snippet, 1)
-        create_file(path, updated_content, require_confirmation=False)
+        end = start + len(original_snippet)
+        if content.find(original_snippet, end) >= 0:
+            ambiguous = True
+            raise ValueError("Ambiguous edit: multiple matches")
+
+        updated_content = content[:start] + new_snippet + content[end:]
+        create_file(path, updated_content)
+        logger.info(f"Applied diff edit to '{path}'")
         console.print(f"[green]✓[/green] Applied diff edit to '[cyan]{path}[/cyan]'")
-        # Record the edit as a system message
-        conversation_history.append({
-            "role": "system",
-            "content": f"File operation: Applied diff edit to '{path}'"
-        })
     except FileNotFoundError:
         logger.exception(f"File not found for diff editing: {path}")
         console.print(f"[red]✗[/red] File not found for diff editing: '[cyan]{path}[/cyan]'", style="red")
     except OSError as e:
         logger.exception(f"OS error occurred while editing '{path}'")
     except ValueError as e:
-        console.print(f"[yellow]⚠[/yellow] {str(e)} in '[cyan]{path}[/cyan]'. No changes made.", style="yellow")
-        console.print("\nExpected snippet:", style="yellow")
-        console.print(Panel(original_snippet, title="Expected", border_style="yellow"))
-        console.print("\nActual file content:", style="yellow")
-        console.print(Panel(content, title="Actual", border_style="yellow"))
+        from rich.console import Group
+
+        report = []
+        if ambiguous:
+            report += [
+                console.render_str("[yellow]Multiple matches found - requiring line numbers for safety", style="yellow"),
+                console.render_str("Use format:\n--- original.py (lines X-Y)\n+++ modified.py\n"),
+            ]
+        report += [
+            console.render_str(f"[yellow]⚠[/yellow] {str(e)} in '[cyan]{path}[/cyan]'. No changes made.", style="yellow"),
+            console.render_str("\nExpected snippet:", style="yellow"),
+            Panel(original_snippet, title="Expected", border_style="yellow"),
+            console.render_str("\nActual file content:", style="yellow"),
+            Panel(content, title="Actual", border_style="yellow"),
+        ]
+        # Edits run concurrently; a single print is written out in one piece, so
+        # other workers' output can't land in the middle of the report
+        console.print(Group(*report))
+
+def run_file_operations(operations: List[tuple]):
+    """
+    Run (path, callable) file operations on a thread pool. Operations on the same
+    file run in their original order on one worker; different files are written
+    concurrently since the work is I/O-bound.
+    """
+    by_path: Dict[str, list] = {}
+    for path, operation in operations:
+        try:
+            key = normalize_path(path)
+        except ValueError:
+            key = path  # The operation itself reports the invalid path
+        by_path.setdefault(key, []).append(operation)
+
+    def run_in_order(file_operations):
+        for operation in file_operations:
+            operation()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(run_in_order, by_path.values()))
 
 def try_handle_add_command(user_input: str) -> bool:
     prefix = "/add "
@@ -272,10 +550,7 @@ def try_handle_add_command(user_input: str) -> bool:
             else:
                 # Handle a single file as before
                 content = read_local_file(normalized_path)
-                conversation_history.append({
-                    "role": "system",
-                    "content": f"Content of file '{normalized_path}':\n\n{content}"
-                })
+                add_file_to_context(normalized_path, content)
                 console.print(f"[green]✓[/green] Added file '[cyan]{normalized_path}[/cyan]' to conversation.\n")
         except OSError as e:
             console.print(f"[red]✗[/red] Could not add path '[cyan]{path_to_add}[/cyan]': {e}\n", style="red")
@@ -332,61 +607,82 @@ def add_directory_to_conversation(directory_path: str):
         max_file_size = 5_000_000  # 5MB limit per file
         MAX_TOTAL_SIZE = 50_000_000  # 50MB total limit
 
-        for root, dirs, files in os.walk(directory_path):
-            if total_files_processed >= max_files or total_size >= MAX_TOTAL_SIZE:
-                console.print(f"[yellow]⚠[/yellow] Reached limit: {total_files_processed} files, {total_size/1_000_000:.1f}MB total")
-                break
+        excluded_exts = frozenset(excluded_extensions)
 
+        def _scan(root: str):
+            """
+            Yield (path, stat) for candidate files under 'root' in os.walk's top-down
+            order. DirEntry answers is_dir()/is_file() from the directory read itself,
+            so only files that pass the name filters cost a stat() call.
+            """
             status.update(f"[bold green]Scanning {root}...")
-            # Skip hidden directories and excluded directories
-            dirs[:] = [d for d in dirs if not d.startswith('.') and d not in excluded_files]
-
-            for file in files:
-                if total_files_processed >= max_files or total_size >= MAX_TOTAL_SIZE:
+            subdirs = []
+            try:
+                with os.scandir(root) as entries:
+                    for entry in entries:
+                        if entry.is_dir():
+                            # Skip hidden directories and excluded directories; like os.walk, don't follow symlinks
+                            if not entry.is_symlink() and not entry.name.startswith('.') and entry.name not in excluded_files:
+                                subdirs.append(entry.path)
+                            continue
+
+                        if entry.name.startswith('.') or entry.name in excluded_files:
+                            skipped_files.append(entry.path)
+                            continue
+
+                        _, ext = os.path.splitext(entry.name)
+                        if ext.lower() in excluded_exts:
+                            skipped_files.append(entry.path)
+                            continue
+
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            skipped_files.append(entry.path)
+                            continue
+                        yield entry.path, stat
+            except OSError:
+                # os.walk silently skips directories it cannot list
+                return
+
+            for subdir in subdirs:
+                yield from _scan(subdir)
+
+        # Cheap name-based filtering happens during the scan; the sniff/read
+        # work per file is I/O-bound and fanned out to a thread pool below.
+        # The scan stays lazy and is consumed one batch at a time, so hitting a
+        # limit also stops the walk instead of listing the whole tree first.
+        scan = _scan(directory_path)
+        process_file = partial(_process_directory_file, max_file_size=max_file_size)
+        batch_size = 64  # Bounds the scanning and reads wasted past the file/size limits
+        limit_reached = False
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            while not limit_reached:
+                batch = list(islice(scan, batch_size))
+                if not batch:
                     break
-
-                if file.startswith('.') or file in excluded_files:
-                    skipped_files.append(os.path.join(root, file))
-                    continue
-
-                _, ext = os.path.splitext(file)
-                if ext.lower() in excluded_extensions:
-                    skipped_files.append(os.path.join(root, file))
-                    continue
-
-                full_path = os.path.join(root, file)
-
-                try:
-                    # Check file size before processing
-                    file_size = os.path.getsize(full_path)
-                    if file_size > max_file_size:
-                        skipped_files.append(f"{full_path} (exceeds size limit)")
+                # Results come back in walk order, so the limits apply exactly as in a serial walk
+                for (full_path, _), result in zip(batch, executor.map(process_file, batch)):
+                    if total_files_processed >= max_files or total_size >= MAX_TOTAL_SIZE:
+                        limit_reached = True
+                        break
+                    if isinstance(result, str):
+                        skipped_files.append(result)
                         continue
 
+                    normalized_path, content, file_size = result
                     if total_size + file_size > MAX_TOTAL_SIZE:
                         skipped_files.append(f"{full_path} (would exceed total size limit)")
                         continue
 
-                    # Check if it's binary
-                    if is_binary_file(full_path):
-                        skipped_files.append(full_path)
-                        continue
-
-                    normalized_path = normalize_path(full_path)
-                    content = read_local_file(normalized_path)
-                    conversation_history.append({
-                        "role": "system",
-                        "content": f"Content of file '{normalized_path}':\n\n{content}"
-                    })
+                    add_file_to_context(normalized_path, content)
                     added_files.append(normalized_path)
                     total_files_processed += 1
                     total_size += file_size
+            if limit_reached:
+                console.print(f"[yellow]⚠[/yellow] Reached limit: {total_files_processed} files, {total_size/1_000_000:.1f}MB total")
 
-                except OSError:
-                    skipped_files.append(full_path)
-                except ValueError as e:
-                    skipped_files.append(f"{full_path} ({str(e)})")
-
+        SNIFF_CACHE.save()
         console.print(f"[green]✓[/green] Added folder '[cyan]{directory_path}[/cyan]' to conversation.")
         console.print(f"Total size: {total_size/1_000_000:.1f}MB")
         if added_files:
@@ -399,28 +695,125 @@ def add_directory_to_conversation(directory_path: str):
                 console.print(f"[yellow]{f}[/yellow]")
         console.print()
 
-def is_binary_file(file_path: str, peek_size: int = 1024) -> bool:
+def _process_directory_file(candidate, max_file_size: int):
+    """
+    Worker for add_directory_to_conversation. Takes a (path, stat) pair from the scan and
+    returns (normalized_path, content, size) for a readable text file, or the entry to
+    list under skipped files.
+    """
+    full_path, stat = candidate
+    try:
+        # Check file size before processing
+        file_size = stat.st_size
+        if file_size > max_file_size:
+            return f"{full_path} (exceeds size limit)"
+
+        # Check if it's binary
+        if is_binary_file(full_path, stat=stat):
+            return full_path
+
+        normalized_path = normalize_path(full_path)
+        return normalized_path, read_local_file(normalized_path), file_size
+    except OSError:
+        return full_path
+    except ValueError as e:
+        return f"{full_path} ({str(e)})"
+
+class SniffCache:
+    """
+    is_binary_file verdicts keyed by path and validated against (mtime_ns, size).
+    Persisted as a single RESPONSE_CACHE entry that is loaded once per session and
+    saved once per directory add, so re-adding an unchanged tree opens no files,
+    even across sessions. Keying by path bounds the entry to one item per file.
+    """
+    def __init__(self, cache: diskcache.Cache, key: str = "binary-sniff-v2"):
+        self._cache = cache
+        self._key = key
+        self._results = None  # path -> (mtime_ns, size, peek_size, is_binary)
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, tuple]:
+        with self._lock:
+            if self._results is None:
+                self._results = self._cache.get(self._key, {})
+        return self._results
+
+    def get(self, file_path: str, stat: os.stat_result, peek_size: int) -> Optional[bool]:
+        entry = self._load().get(file_path)
+        if entry and entry[:3] == (stat.st_mtime_ns, stat.st_size, peek_size):
+            return entry[3]
+        return None
+
+    def set(self, file_path: str, stat: os.stat_result, peek_size: int, is_binary: bool):
+        self._load()[file_path] = (stat.st_mtime_ns, stat.st_size, peek_size, is_binary)
+        self._dirty = True
+
+    def save(self):
+        if self._dirty:
+            self._cache.set(self._key, self._results)
+            self._dirty = False
+
+SNIFF_CACHE = SniffCache(RESPONSE_CACHE)
+
+# Leading bytes of common binary formats that may not have a NUL in the first KB.
+# Each contains a non-ASCII or control byte, so no ordinary text file starts with one.
+_BINARY_MAGIC = (
+    b"\x89PNG", b"\xff\xd8\xff", b"PK\x03\x04", b"\x7fELF", b"\x1f\x8b",
+    b"\xfd7zXZ", b"7z\xbc\xaf\x27\x1c", b"Rar!\x1a\x07", b"SQLite format 3\x00",
+    b"\xca\xfe\xba\xbe", b"\xcf\xfa\xed\xfe", b"\x00asm",
+)
+# Plain-ASCII signatures ("ID3 tags..." is a valid first line of a note), so these
+# only count when the rest of the sample does not look like text either
+_ASCII_MAGIC = (
+    b"GIF87a", b"GIF89a", b"%PDF-", b"BZh", b"wOFF", b"wOF2", b"OggS", b"ID3", b"fLaC",
+)
+_TEXT_CONTROL_BYTES = frozenset(b"\t\n\r\f\b\x1b")
+
+def _looks_like_text(chunk: bytes) -> bool:
+    if any(byte < 0x20 and byte not in _TEXT_CONTROL_BYTES for byte in chunk):
+        return False
+    try:
+        # Incremental decode: a multi-byte character cut off at the end of the sample is fine
+        codecs.getincrementaldecoder("utf-8")().decode(chunk)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+def is_binary_file(file_path: str, peek_size: int = 1024, stat: Optional[os.stat_result] = None) -> bool:
+    if stat is None:
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return True
+    # Fast path: an unchanged file that was sniffed before is never reopened
+    cached = SNIFF_CACHE.get(file_path, stat, peek_size)
+    if cached is not None:
+        return cached
+
     try:
         with open(file_path, 'rb') as f:
             chunk = f.read(peek_size)
-        # If there is a null byte in the sample, treat it as binary
-        if b'\0' in chunk:
-            return True
-        return False
     except Exception:
         # If we fail to read, just treat it as binary to be safe
         return True
+    # If there is a null byte in the sample or a known binary signature, treat it as binary
+    is_binary = (
+        b'\0' in chunk
+        or chunk.startswith(_BINARY_MAGIC)
+        or (chunk.startswith(_ASCII_MAGIC) and not _looks_like_text(chunk))
+    )
+    SNIFF_CACHE.set(file_path, stat, peek_size, is_binary)
+    return is_binary
 
 def ensure_file_in_context(file_path: str) -> bool:
     try:
         normalized_path = normalize_path(file_path)
+        # O(1) membership check; the content only has to be read for new files
+        if normalized_path in _file_msgs:
+            return True
         content = read_local_file(normalized_path)
-        file_marker = f"Content of file '{normalized_path}'"
-        if not any(file_marker in msg["content"] for msg in conversation_history):
-            conversation_history.append({
-                "role": "system",
-                "content": f"{file_marker}:\n\n{content}"
-            })
+        add_file_to_context(normalized_path, content)
         return True
     except OSError:
         console.print(f"[red]✗[/red] Could not read file '[cyan]{file_path}[/cyan]' for editing context", style="red")
@@ -428,14 +821,19 @@ def ensure_file_in_context(file_path: str) -> bool:
 
 def normalize_path(path_str: str) -> str:
     """Return a canonical, absolute version of the path with security checks."""
+    # resolve() stats every path component; passing the cwd keeps cached results valid across chdir
+    return _normalize_path_cached(path_str, os.getcwd())
+
+@lru_cache(maxsize=4096)
+def _normalize_path_cached(path_str: str, cwd: str) -> str:
     try:
         path = Path(path_str)
         if not path.is_absolute():
-            path = path.absolute()
+            path = Path(cwd) / path
         path = path.resolve()
 
         # Ensure path is within workspace
-        workspace = Path(os.getcwd()).resolve()
+        workspace = Path(cwd).resolve()
         if not str(path).startswith(str(workspace)):
             raise ValueError(f"Invalid path: {path_str} is outside workspace directory")
 
@@ -446,108 +844,294 @@ def normalize_path(path_str: str) -> str:
 # --------------------------------------------------------------------------------
 # 5. Conversation state
 # --------------------------------------------------------------------------------
-conversation_history = [
-    {"role": "system", "content": system_PROMPT}
-]
+# Kept as separate parts so each request is composed in order (system prompt,
+# file contents, completed user/assistant pairs) without re-partitioning the
+# whole history every turn. File contents live once in a content-addressed
+# blob store and are referenced by hash; their messages are only materialized,
+# sorted by path, when a request is built, so the request prefix stays
+# byte-identical between turns and the provider's prompt cache can reuse it.
+_system_msgs = [{"role": "system", "content": system_PROMPT}]
+_blob_store: Dict[str, str] = {}  # sha256 -> file content
+_file_msgs: Dict[str, str] = {}  # normalized path -> sha256
+_pair_msgs = []
+_applied_ops: List[Dict[str, Any]] = []  # Local audit log of file writes; never sent to the model
+_context_lock = threading.Lock()  # File writes update the context from worker threads
+
+def add_file_to_context(normalized_path: str, content: str, sha: Optional[str] = None):
+    """Add or refresh the content of a file in the conversation; unchanged content is a no-op."""
+    sha = sha or content_sha256(content)
+    with _context_lock:
+        previous_sha = _file_msgs.get(normalized_path)
+        if previous_sha == sha:
+            return
+        _blob_store.setdefault(sha, content)
+        _file_msgs[normalized_path] = sha
+        if previous_sha is not None and previous_sha not in _file_msgs.values():
+            del _blob_store[previous_sha]
+
+def file_context_msg(normalized_path: str, sha: str) -> Dict[str, Any]:
+    return {
+        "role": "system",
+        "content": f"Content of file '{normalized_path}':\n\n{_blob_store[sha]}"
+    }
+
+def file_context_msgs():
+    return (file_context_msg(path, sha) for path, sha in sorted(_file_msgs.items()))
+
+def file_context_keys() -> set:
+    return set(_file_msgs.items())
+
+class ResponseChain:
+    """
+    Tracks server-side conversation state for providers that implement the
+    Responses API. Each turn only sends what the server has not seen yet and
+    points at the previous response via previous_response_id.
+    """
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        self.last_response_id = None
+        self.sent_files = set()  # (path, sha256) already on the server
+        self.sent_pairs = 0
+
+    def pending_input(self, user_msg: Dict[str, Any]) -> List[Dict[str, Any]]:
+        new_files = [
+            file_context_msg(path, sha) for path, sha in sorted(_file_msgs.items())
+            if (path, sha) not in self.sent_files
+        ]
+        return list(chain(new_files, _pair_msgs[self.sent_pairs:], [user_msg]))
+
+    def advance(self, response_id: str, sent_files: set):
+        self.last_response_id = response_id
+        self.sent_files = sent_files
+        self.sent_pairs = len(_pair_msgs)
+
+# DeepSeek does not implement the Responses API yet, so chaining is opt-in
+RESPONSE_CHAIN = ResponseChain(enabled=os.getenv("DEEPSEEK_USE_RESPONSES_API") == "1")
 
 # --------------------------------------------------------------------------------
 # 6. OpenAI API interaction with streaming
 # --------------------------------------------------------------------------------
 
+# Path-like tokens: anything containing a slash, or a name with a recognized extension.
+# Both end on a word character or hyphen, so trailing sentence punctuation is dropped.
+# The lookbehind only lets a match start where a run of path characters begins; without
+# it every position of a long word (minified JS, a pasted log line) rescans the rest of
+# the run, which is quadratic.
+_PATH_RE = re.compile(r"(?<![\w.\-])(?:[\w.\-]*(?:/[\w.\-]*[\w\-])+|[\w.\-]+\.(?:css|html|js|py|json|md)\b)")
+
 def guess_files_in_message(user_message: str) -> List[str]:
-    recognized_extensions = [".css", ".html", ".js", ".py", ".json", ".md"]
+    # URLs match the slash pattern too, so leave out any token that contains one
+    text = " ".join(token for token in user_message.split() if "://" not in token)
+    candidates = _PATH_RE.findall(text)
+    if not candidates:
+        return []
     potential_paths = []
-    for word in user_message.split():
-        if any(ext in word for ext in recognized_extensions) or "/" in word:
-            path = word.strip("',\"")
-            try:
-                normalized_path = normalize_path(path)
-                potential_paths.append(normalized_path)
-            except (OSError, ValueError):
-                continue
+    for path in dict.fromkeys(candidates):
+        try:
+            normalized_path = normalize_path(path)
+        except (OSError, ValueError):
+            continue
+        if normalized_path not in potential_paths:
+            potential_paths.append(normalized_path)
     return potential_paths
 
-def stream_openai_response(user_message: str):
-    # First, clean up the conversation history while preserving system messages with file content
-    system_msgs = [conversation_history[0]]  # Keep initial system prompt
-    file_context = []
-    user_assistant_pairs = []
-
-    for msg in conversation_history[1:]:
-        if msg["role"] == "system" and "Content of file '" in msg["content"]:
-            file_context.append(msg)
-        elif msg["role"] in ["user", "assistant"]:
-            user_assistant_pairs.append(msg)
+class TokenRenderer:
+    """
+    Prints streamed reasoning tokens from a background thread, batching whatever
+    arrived since the last frame into one write (~60 FPS), so Rich's locking,
+    rendering and flushing never sit between reads from the socket.
+    """
+    def __init__(self, header: str, frame_interval: float = 1 / 60):
+        self.header = header
+        self.frame_interval = frame_interval
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="token-renderer", daemon=True)
+        self._thread.start()
+
+    def put(self, text: str):
+        self._queue.put(text)
+
+    def close(self):
+        """Flush everything queued so far and stop the render thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        started = False
+        while True:
+            buffer = [self._queue.get()]
+            while True:
+                try:
+                    buffer.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            done = buffer[-1] is None  # close() always enqueues last
+            text = "".join(buffer[:-1] if done else buffer)
+            if text:
+                if not started:
+                    console.print(self.header, style="bold yellow")
+                    started = True
+                console.out(text, end="")
+            if done:
+                return
+            time.sleep(self.frame_interval)
+
+def extract_json(content: str) -> str:
+    """Return the body of the first ```json (or bare ```) code block, or 'content' unchanged."""
+    start = content.find('```json')
+    if start >= 0:
+        start += len('```json')
+    else:
+        start = content.find('```')
+        if start < 0:
+            return content
+        start += len('```')
+    end = content.find('```', start)
+    return content[start:end if end >= 0 else len(content)].strip()
+
+def log_prompt_cache_usage(usage):
+    # DeepSeek reports prompt-cache hits as extra usage fields; OpenAI-style
+    # providers use prompt_tokens_details / input_tokens_details instead
+    hit = getattr(usage, "prompt_cache_hit_tokens", None)
+    miss = getattr(usage, "prompt_cache_miss_tokens", None)
+    if hit is None:
+        details = getattr(usage, "prompt_tokens_details", None) or getattr(usage, "input_tokens_details", None)
+        hit = getattr(details, "cached_tokens", None)
+    if hit is not None:
+        logger.info(f"Prompt cache: {hit} cached prompt tokens" + (f", {miss} uncached" if miss is not None else ""))
+
+def response_cache_key(messages: List[Dict[str, Any]]) -> str:
+    payload = json.dumps(messages, sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(payload.encode("utf-8")).hexdigest()
+
+async def stream_completion(messages: List[Dict[str, Any]]) -> str:
+    """Stream a completion for 'messages', echoing the reasoning, and return the final content."""
+    stream = await get_client().chat.completions.create(
+        model="deepseek-reasoner",
+        messages=messages,
+        max_completion_tokens=8000,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
 
-    # Only keep complete user-assistant pairs
-    if len(user_assistant_pairs) % 2 != 0:
-        user_assistant_pairs = user_assistant_pairs[:-1]
+    console.print("\nThinking...", style="bold yellow")
+    reasoning = TokenRenderer("\nReasoning:")
+    final_content = ""
+    FILE_STAGER.begin()
 
-    # Rebuild clean history with files preserved
-    cleaned_history = system_msgs + file_context
-    cleaned_history.extend(user_assistant_pairs)
-    cleaned_history.append({"role": "user", "content": user_message})
+    try:
+        async for chunk in stream:
+            if chunk.usage:
+                log_prompt_cache_usage(chunk.usage)
+            # The final usage chunk carries no choices
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.reasoning_content:
+                reasoning.put(delta.reasoning_content)
+            if delta.content:
+                final_content += delta.content
+                FILE_STAGER.feed(delta.content)
+    finally:
+        reasoning.close()
+
+    FILE_STAGER.finish()
+    console.clear_live()
+    console.show_cursor(True)
+    console.print("\n")
+    return final_content
+
+async def stream_response(input_msgs: List[Dict[str, Any]]):
+    """
+    Responses API variant of stream_completion that continues the chain from
+    RESPONSE_CHAIN.last_response_id. Returns (final_content, response_id).
+    """
+    stream = await get_client().responses.create(
+        model="deepseek-reasoner",
+        instructions=system_PROMPT,
+        input=input_msgs,
+        previous_response_id=RESPONSE_CHAIN.last_response_id,
+        max_output_tokens=8000,
+        stream=True
+    )
 
-    # Replace conversation_history with cleaned version
-    conversation_history.clear()
-    conversation_history.extend(cleaned_history)
+    console.print("\nThinking...", style="bold yellow")
+    reasoning = TokenRenderer("\nReasoning:")
+    final_content = ""
+    response_id = None
+    FILE_STAGER.begin()
 
+    try:
+        async for event in stream:
+            if event.type == "response.reasoning_text.delta":
+                reasoning.put(event.delta)
+            elif event.type == "response.output_text.delta":
+                final_content += event.delta
+                FILE_STAGER.feed(event.delta)
+            elif event.type == "response.completed":
+                response_id = event.response.id
+                if event.response.usage:
+                    log_prompt_cache_usage(event.response.usage)
+    finally:
+        reasoning.close()
+
+    FILE_STAGER.finish()
+    console.clear_live()
+    console.show_cursor(True)
+    console.print("\n")
+    return final_content, response_id
+
+async def stream_openai_response(user_message: str, use_cache: bool = True):
     potential_paths = guess_files_in_message(user_message)
-    valid_files = {}
 
     for path in potential_paths:
         try:
-            content = read_local_file(path)
-            valid_files[path] = content
-            file_marker = f"Content of file '{path}'"
-            if not any(file_marker in msg["content"] for msg in conversation_history):
-                conversation_history.append({
-                    "role": "system",
-                    "content": f"{file_marker}:\n\n{content}"
-                })
+            content = await asyncio.to_thread(read_local_file, path)
+            add_file_to_context(path, content)
         except OSError:
             error_msg = f"Cannot proceed: File '{path}' does not exist or is not accessible"
             console.print(f"[red]✗[/red] {error_msg}", style="red")
             continue
 
-    try:
-        stream = client.chat.completions.create(
-            model="deepseek-reasoner",
-            messages=conversation_history,
-            max_completion_tokens=8000,
-            stream=True
-        )
-
-        console.print("\nThinking...", style="bold yellow")
-        reasoning_started = False
-        reasoning_content = ""
-        final_content = ""
+    # The user message only joins _pair_msgs once a full reply is parsed, so
+    # failed turns never leave a dangling user message in the history
+    user_msg = {"role": "user", "content": user_message}
+    messages = list(chain(_system_msgs, file_context_msgs(), _pair_msgs, [user_msg]))
 
-        for chunk in stream:
-            delta = chunk.choices[0].delta
-            if delta.reasoning_content:
-                if not reasoning_started:
-                    console.print("\nReasoning:", style="bold yellow")
-                    reasoning_started = True
-                console.print(delta.reasoning_content, end="")
-                reasoning_content += delta.reasoning_content
-            if delta.content:
-                final_content += delta.content
+    cache_key = response_cache_key(messages)
+    semantic_key = SEMANTIC_CACHE.context_key(list(_file_msgs.values()), _pair_msgs)
 
-        console.clear_live()
-        console.show_cursor(True)
-        console.print("\n")
+    try:
+        final_content = RESPONSE_CACHE.get(cache_key) if use_cache else None
+        if final_content is None and use_cache:
+            final_content = await asyncio.to_thread(SEMANTIC_CACHE.lookup, user_message, semantic_key)
+        cache_hit = final_content is not None
+        if cache_hit:
+            logger.info(f"Response cache hit for key {cache_key[:12]}")
+            console.print("\n[dim]Using cached response (prefix your message with /nocache to bypass)[/dim]\n")
+        else:
+            sent_files = file_context_keys()
+            response_id = None
+            if RESPONSE_CHAIN.enabled:
+                from openai import NotFoundError
+                try:
+                    final_content, response_id = await stream_response(RESPONSE_CHAIN.pending_input(user_msg))
+                except NotFoundError:
+                    logger.info("Responses API not available for this provider; falling back to chat completions")
+                    RESPONSE_CHAIN.enabled = False
+            if final_content is None:
+                final_content = await stream_completion(messages)
+            log_connection_pool()
 
-        # Extract JSON from code block if present
-        json_str = final_content
-        if '```json' in final_content:
-            json_str = final_content.split('```json')[1].split('```')[0].strip()
-        elif '```' in final_content:
-            json_str = final_content.split('```')[1].split('```')[0].strip()
+        json_str = extract_json(final_content)
 
         try:
-            parsed_response = json.loads(json_str)
-        except json.JSONDecodeError as e:
+            # Single decode + validate pass straight into the response structs
+            response_obj = msgspec.json.decode(json_str, type=AssistantResponse)
+        except msgspec.DecodeError as e:  # Also covers schema ValidationError
             error_msg = f"Failed to parse JSON response from assistant: {str(e)}"
             console.print(f"[red]✗[/red] {error_msg}", style="red")
             console.print(Panel(final_content, title="[red]Invalid JSON Response[/red]", border_style="red"))
@@ -556,8 +1140,11 @@ def stream_openai_response(user_message: str):
                 files_to_create=[]
             )
 
+        from rich.console import Group
+        from rich.rule import Rule
+
         # Extract and format assistant reply
-        assistant_reply = parsed_response.get("assistant_reply", "")
+        assistant_reply = response_obj.assistant_reply
         parts = [part.strip() for part in assistant_reply.split("|")]
         renderables = []
 
@@ -580,29 +1167,32 @@ def stream_openai_response(user_message: str):
         )
 
         try:
-            if "assistant_reply" not in parsed_response:
-                parsed_response["assistant_reply"] = ""
-
-            if "files_to_edit" in parsed_response and parsed_response["files_to_edit"]:
+            if response_obj.files_to_edit:
                 new_files_to_edit = []
-                for edit in parsed_response["files_to_edit"]:
+                for edit in response_obj.files_to_edit:
                     try:
-                        edit_abs_path = normalize_path(edit["path"])
-                        if edit_abs_path in valid_files or ensure_file_in_context(edit_abs_path):
-                            edit["path"] = edit_abs_path
+                        edit_abs_path = normalize_path(edit.path)
+                        if ensure_file_in_context(edit_abs_path):
+                            edit.path = edit_abs_path
                             new_files_to_edit.append(edit)
                     except (OSError, ValueError):
-                        console.print(f"[yellow]⚠[/yellow] Skipping invalid path: '{edit['path']}'", style="yellow")
+                        console.print(f"[yellow]⚠[/yellow] Skipping invalid path: '{edit.path}'", style="yellow")
                         continue
-                parsed_response["files_to_edit"] = new_files_to_edit
-
-            response_obj = AssistantResponse(**parsed_response)
-
-            # Store the complete JSON response in conversation history
-            conversation_history.append({
-                "role": "assistant",
-                "content": final_content  # Store the full JSON response string
-            })
+                response_obj.files_to_edit = new_files_to_edit
+
+            if not cache_hit:
+                RESPONSE_CACHE.set(cache_key, final_content)
+                await asyncio.to_thread(SEMANTIC_CACHE.add, user_message, semantic_key, final_content)
+
+            # Only the reply goes into history: the file operations echo whole file
+            # contents, which are already in context once applied. The reply stays
+            # wrapped in JSON so prior turns keep modelling the required output format.
+            _pair_msgs.extend([
+                user_msg,
+                {"role": "assistant", "content": json.dumps({"assistant_reply": response_obj.assistant_reply}, ensure_ascii=False)}
+            ])
+            if not cache_hit and response_id is not None:
+                RESPONSE_CHAIN.advance(response_id, sent_files)
 
             return response_obj
 
@@ -625,21 +1215,18 @@ def stream_openai_response(user_message: str):
 def trim_conversation_history():
     """Trim conversation history to prevent token limit issues"""
     max_pairs = 10  # Adjust based on your needs
-    system_msgs = [msg for msg in conversation_history if msg["role"] == "system"]
-    other_msgs = [msg for msg in conversation_history if msg["role"] != "system"]
 
     # Keep only the last max_pairs of user-assistant interactions
-    if len(other_msgs) > max_pairs * 2:
-        other_msgs = other_msgs[-max_pairs * 2:]
-
-    conversation_history.clear()
-    conversation_history.extend(system_msgs + other_msgs)
+    if len(_pair_msgs) > max_pairs * 2:
+        del _pair_msgs[:-max_pairs * 2]
+        # The server-side chain still holds the untrimmed history
+        RESPONSE_CHAIN.reset()
 
 # --------------------------------------------------------------------------------
 # 7. Main interactive loop
 # --------------------------------------------------------------------------------
 
-def main():
+async def main():
     # Validate OpenAI API key
     if not os.getenv("DEEPSEEK_API_KEY"):
         logger.error("DEEPSEEK_API_KEY environment variable not set")
@@ -658,12 +1245,13 @@ def main():
         "  • '[bold magenta]/add path/to/file[/bold magenta]' for a single file\n"
         "  • '[bold magenta]/add path/to/folder[/bold magenta]' for all files in a folder\n"
         "  • You can add multiple files one by one using /add for each file\n"
+        "Prefix a message with '[bold magenta]/nocache[/bold magenta]' to skip the response cache.\n"
         "Type '[bold red]exit[/bold red]' or '[bold red]quit[/bold red]' to end.\n"
     )
 
     while True:
         try:
-            user_input = prompt_session.prompt("You> ").strip()
+            user_input = (await get_prompt_session().prompt_async("You> ")).strip()
         except (EOFError, KeyboardInterrupt):
             console.print("\n[yellow]Exiting.[/yellow]")
             break
@@ -678,25 +1266,48 @@ def main():
         if try_handle_add_command(user_input):
             continue
 
-        with rate_limiter:
-            response_data = stream_openai_response(user_input)
+        use_cache = True
+        nocache_prefix = "/nocache "
+        if user_input.lower().startswith(nocache_prefix):
+            user_input = user_input[len(nocache_prefix):].strip()
+            use_cache = False
+            if not user_input:
+                continue
+
+        async with rate_limiter:
+            response_data = await stream_openai_response(user_input, use_cache=use_cache)
 
         if response_data.files_to_create:
+            console.print("\n[bold]Files to create/overwrite:[/bold]")
             for file_info in response_data.files_to_create:
-                create_file(file_info.path, file_info.content)
+                console.print(f"  [cyan]{file_info.path}[/cyan]")
+            # One confirmation for the whole batch, then the writes run concurrently
+            user_confirm = (await get_prompt_session().prompt_async(
+                f"Do you want to create/overwrite these {len(response_data.files_to_create)} file(s)? (y/n): "
+            )).strip().lower()
+            if user_confirm == 'y' or not user_confirm:
+                run_file_operations([
+                    (file_info.path, partial(create_file, file_info.path, file_info.content))
+                    for file_info in response_data.files_to_create
+                ])
+            else:
+                console.print("[yellow]ℹ[/yellow] Skipped file creation.", style="yellow")
+        FILE_STAGER.discard()
 
         if response_data.files_to_edit:
             show_diff_table(response_data.files_to_edit)
-            user_confirm = prompt_session.prompt(
+            user_confirm = (await get_prompt_session().prompt_async(
                 "Do you want to apply these changes? (y/n): "
-            ).strip().lower()
+            )).strip().lower()
             if user_confirm == 'y':
-                for edit_info in response_data.files_to_edit:
-                    apply_diff_edit(edit_info.path, edit_info.original_snippet, edit_info.new_snippet)
+                run_file_operations([
+                    (edit_info.path, partial(apply_diff_edit, edit_info.path, edit_info.original_snippet, edit_info.new_snippet))
+                    for edit_info in response_data.files_to_edit
+                ])
             else:
                 console.print("[yellow]ℹ[/yellow] Skipped applying diff edits.", style="yellow")
 
     console.print("[blue]Session finished.[/blue]")
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())